@@ -1,16 +1,18 @@
 from dist import *
+import instrument
+from instrument import profiling
 
 from collections import namedtuple
 from enum import Enum, unique
-from itertools import permutations
+from itertools import accumulate, permutations, product
+import bisect
+import contextlib
+import contextvars
+import functools
+import heapq
 import inspect
 import sys
 
-debug = False
-def debug_log(*args, **kwargs):
-    if debug:
-        print(*args, **kwargs)
-
 @unique
 class MoveType(Enum):
     T = "Treads"
@@ -306,13 +308,26 @@ JUGGER_SCOP_LUCK = (Dist.d(95) - 1) - (Dist.d(45) - 1)
 
 STANDARD_STATS = lambda unit: (100, 100)
 STANDARD_BOOST = lambda unit: (10, 10)
-TOWERS = 1
-DTOWERS = 1
 
 
+# The scenario settings that aren't properties of any one unit. CO hooks can
+# take the meta as a third argument: lambda unit, other, meta: ...
+Meta = namedtuple("Meta", ["towers", "dtowers", "attacker_power", "defender_power", "cities"])
+
+_default_meta = Meta(1, 1, no_power, no_power, 0)
+_scoped_meta = contextvars.ContextVar("awars_meta", default=None)
+
+def current_meta():
+    """ Returns the meta set by the innermost using_meta() block, or else by set_meta(). """
+    return _scoped_meta.get() or _default_meta
+
+
+@functools.lru_cache(maxsize=None)
+def _arg_count(f):
+    return len(inspect.getfullargspec(f).args)
+
 def invoke_with_desired_args(f, args):
-    spec = inspect.getfullargspec(f)
-    return f(*args[:len(spec.args)])
+    return f(*args[:_arg_count(f)])
 
 
 class CommandingOfficer:
@@ -327,27 +342,30 @@ class CommandingOfficer:
     def with_towers(self, towers):
         return CommandingOfficer(towers, self.luck, self.stat_override, self.cop_boost, self.scop_boost)
 
-    def tower_boost(self):
+    def tower_boost(self, meta=None):
         if self.towers is None:
-            return TOWERS * 10
+            return (meta or current_meta()).towers * 10
         return self.towers * 10
 
-    def power_boost(self, unit, power, other):
+    def power_boost(self, unit, power, other, meta=None):
+        meta = meta or current_meta()
         if power == PowerType.no_power:
             return 0, 0
         elif power == PowerType.cop:
-            return invoke_with_desired_args(self.cop_boost, [unit, other])
+            return invoke_with_desired_args(self.cop_boost, [unit, other, meta])
         elif power == PowerType.scop:
-            return invoke_with_desired_args(self.scop_boost, [unit, other])
-
-    def attack_for(self, unit, power, defender):
-        base_attack, _ = invoke_with_desired_args(self.stat_override, [unit, defender])
-        attack_boost, _ = self.power_boost(unit, power, defender)
-        return base_attack + attack_boost + self.tower_boost()
-
-    def defense_for(self, unit, power, attacker):
-        _, base_defense = invoke_with_desired_args(self.stat_override, [unit, attacker])
-        _, def_boost = self.power_boost(unit, power, attacker)
+            return invoke_with_desired_args(self.scop_boost, [unit, other, meta])
+
+    def attack_for(self, unit, power, defender, meta=None):
+        meta = meta or current_meta()
+        base_attack, _ = invoke_with_desired_args(self.stat_override, [unit, defender, meta])
+        attack_boost, _ = self.power_boost(unit, power, defender, meta)
+        return base_attack + attack_boost + self.tower_boost(meta)
+
+    def defense_for(self, unit, power, attacker, meta=None):
+        meta = meta or current_meta()
+        _, base_defense = invoke_with_desired_args(self.stat_override, [unit, attacker, meta])
+        _, def_boost = self.power_boost(unit, power, attacker, meta)
         return base_defense + def_boost
 
     def __call__(self, *args, **kwargs):
@@ -365,42 +383,67 @@ class CommandingOfficer:
         return units[0](*new_args)
 
 
-ATTACKER_POWER = PowerType.no_power
-DEFENDER_POWER = PowerType.no_power
-ATTACKER_CITIES = 0
-
-def set_meta(*args, cities=None):
-    global TOWERS
-    global DTOWERS
-    global ATTACKER_POWER
-    global DEFENDER_POWER
-    global ATTACKER_CITIES
-
+def make_meta(*args, cities=None):
+    """ Builds a Meta from set_meta style arguments, e.g. make_meta(2, 1, cop, no_power, cities=4). """
     int_args = [arg for arg in args if  isinstance(arg, int)]
     power_args = [arg for arg in args if  isinstance(arg, PowerType)]
 
-    TOWERS = int_args[0] if int_args else 1
-    DTOWERS = int_args[1] if len(int_args) > 1 else TOWERS
+    towers = int_args[0] if int_args else 1
+    dtowers = int_args[1] if len(int_args) > 1 else towers
+
+    attacker_power = power_args[0] if power_args else no_power
+    defender_power = power_args[1] if len(power_args) > 1 else no_power
+    return Meta(towers, dtowers, attacker_power, defender_power, cities or 0)
+
+def set_meta(*args, cities=None):
+    """ Sets the default meta used outside of any using_meta() block. """
+    global _default_meta
 
-    ATTACKER_POWER = power_args[0] if power_args else no_power
-    DEFENDER_POWER = power_args[1] if len(power_args) > 1 else no_power
-    if cities is not None:
-        ATTACKER_CITIES = cities
+    if cities is None:
+        cities = _default_meta.cities
+    _default_meta = make_meta(*args, cities=cities)
 
-    cities_prompt = "_" + str(ATTACKER_CITIES) if ATTACKER_CITIES else ""
+    cities_prompt = "_" + str(cities) if cities else ""
 
-    sys.ps1 = str(TOWERS) + str(DTOWERS) + ATTACKER_POWER.char + DEFENDER_POWER.char + cities_prompt + ">>> "
+    sys.ps1 = (str(_default_meta.towers) + str(_default_meta.dtowers) + _default_meta.attacker_power.char
+               + _default_meta.defender_power.char + cities_prompt + ">>> ")
 
 set_meta(1)
 
 def get_meta():
-    return {
-        "towers": TOWERS,
-        "dtowers": DTOWERS,
-        "attacker_power": ATTACKER_POWER,
-        "defender_power": DEFENDER_POWER,
-        "cities": ATTACKER_CITIES,
-    }
+    return dict(current_meta()._asdict())
+
+@contextlib.contextmanager
+def using_meta(*args, cities=None):
+    """ Evaluates the block under a different meta without touching the default.
+
+        The meta is held in a context variable, so concurrent threads and tasks
+        can each use their own. Accepts a Meta or set_meta style arguments.
+    """
+    if len(args) == 1 and isinstance(args[0], Meta):
+        meta = args[0]
+    else:
+        meta = make_meta(*args, cities=cities)
+    token = _scoped_meta.set(meta)
+    try:
+        yield meta
+    finally:
+        _scoped_meta.reset(token)
+
+def _call_with_meta(f, meta):
+    with using_meta(meta):
+        return f()
+
+def map_meta(f, metas, executor=None):
+    """ Calls f() once under each meta, optionally in parallel on an executor.
+
+        For a process pool f must be picklable, e.g. a module level function or
+        functools.partial.
+    """
+    metas = list(metas)
+    if executor is None:
+        return [_call_with_meta(f, meta) for meta in metas]
+    return list(executor.map(_call_with_meta, [f] * len(metas), metas))
 
 
 def unimplemented(message):
@@ -440,9 +483,11 @@ jake = CommandingOfficer(
 
 # TODO: use the actual CO's tower value in case of asymmetry?
 javier = CommandingOfficer(
-        stat_override=lambda unit, other: (100, 100 + 10 * DTOWERS + (20 if other.is_indirect else 0)),
-        cop_boost= lambda unit, other: (10 + 10 * TOWERS, 10 + 10 * DTOWERS + (20 if other.is_indirect else 0)),
-        scop_boost=lambda unit, other: (10 + 20 * TOWERS, 10 + 20 * DTOWERS + (40 if other.is_indirect else 0)))
+        stat_override=lambda unit, other, meta: (100, 100 + 10 * meta.dtowers + (20 if other.is_indirect else 0)),
+        cop_boost= lambda unit, other, meta: (10 + 10 * meta.towers,
+                                              10 + 10 * meta.dtowers + (20 if other.is_indirect else 0)),
+        scop_boost=lambda unit, other, meta: (10 + 20 * meta.towers,
+                                              10 + 20 * meta.dtowers + (40 if other.is_indirect else 0)))
 
 jess = CommandingOfficer(
         stat_override=lambda unit: (110, 100) if unit.is_vehicle else (90, 100),
@@ -459,9 +504,9 @@ kanbei = CommandingOfficer(
         cop_boost=lambda unit: (20, 10),
         scop_boost=lambda unit: (20, 30))
 
-def kindle_scop(unit):
+def kindle_scop(unit, other, meta):
     a, d = (140, 10) if unit.terrain.type.is_urban else (10, 10)
-    cities_boost = ATTACKER_CITIES * 3
+    cities_boost = meta.cities * 3
     return (a + cities_boost, d)
 kindle = CommandingOfficer(
         stat_override=lambda unit: (140, 100) if unit.terrain.type.is_urban else (100, 100),
@@ -506,6 +551,53 @@ von_bolt = CommandingOfficer(stat_override=lambda unit: (110, 110))
 vb = von_bolt
 
 
+DAMAGE_CACHE_SIZE = 100000
+_DAMAGE_CACHE = {}
+
+def clear_caches():
+    _DAMAGE_CACHE.clear()
+
+def cached_damage(key):
+    """ The damage_kernel for a Unit.damage_key, computed once per backend and then served from the cache. """
+    # kernels computed by one backend aren't reused (or left unchecked) under another
+    cache_key = (get_backend().name, key)
+    final_damage = _DAMAGE_CACHE.get(cache_key)
+    if final_damage is None:
+        instrument.count("damage_to.cache_miss")
+        if len(_DAMAGE_CACHE) >= DAMAGE_CACHE_SIZE:
+            _DAMAGE_CACHE.clear()
+        final_damage = _DAMAGE_CACHE[cache_key] = damage_kernel(*key)._maybe_intern()
+    else:
+        instrument.count("damage_to.cache_hit")
+    return final_damage
+
+def damage_kernel(base, co_attack, luck, attacker_hp, co_defense, terrain_stars, defender_hp):
+    """ Computes the final damage distribution from the values in a Unit.damage_key. """
+    with instrument.span("damage_to.base_damage"):
+        base_damage = Dist.exactly(base)
+        attacker_hp = Dist(attacker_hp)
+        defender_hp = Dist(defender_hp)
+
+    with instrument.span("damage_to.luck"):
+        co_adjusted_damage = (base_damage.scale(co_attack / 100)) + luck
+        hp_adjusted_damage = (attacker_hp.clamp(range(10)) / 10) * co_adjusted_damage
+    instrument.count_dist("damage_to.luck", hp_adjusted_damage)
+
+    with instrument.span("damage_to.defense"):
+        terrain_defense = Dist.exactly(0) if terrain_stars is None else defender_hp.scale(terrain_stars)
+        total_defense = co_defense + terrain_defense
+        instrument.count_dist("defense_rating", total_defense)
+        defense_multiplier = total_defense.transform(lambda v: (200 - v) / 100, lambda a: (200 - a) / 100)
+        raw_damage = hp_adjusted_damage * defense_multiplier
+    instrument.count_dist("damage_to.raw", raw_damage)
+
+    with instrument.span("damage_to.rounding"):
+        final_damage = raw_damage.round_awars()
+    instrument.count_dist("damage_to.final", final_damage)
+
+    return final_damage
+
+
 class Unit:
 
     def __init__(self, unit, co=CommandingOfficer(), power=None, terrain=shoal, raw_hp=Dist([(100, 1)])):
@@ -528,6 +620,7 @@ class Unit:
             raise Exception("Unrecognized terrain value: " + repr(terrain))
 
         self.raw_hp = raw_hp
+        self._displayed_hp = None
 
     def __repr__(self):
         return ("<" + str(self.data.type.name)
@@ -604,13 +697,21 @@ class Unit:
 
     @property
     def displayed_hp(self):
-        return self.displayed_hp_raw.normalize()
+        # units are never mutated, so this is computed once per unit
+        if self._displayed_hp is None:
+            self._displayed_hp = self.displayed_hp_raw.normalize()
+        return self._displayed_hp
+
+    @property
+    def ko_chance(self):
+        return sum(c for v, c in self.displayed_hp._buckets if v <= 0)
 
-    def defense_rating(self, attacker=None):
-        co_defense = self.co.defense_for(self, (self.power or DEFENDER_POWER), attacker)
+    def defense_rating(self, attacker=None, meta=None):
+        meta = meta or current_meta()
+        co_defense = self.co.defense_for(self, (self.power or meta.defender_power), attacker, meta)
         terrain_defense = Dist.exactly(0) if self.is_air else self.displayed_hp.scale(self.terrain.defense)
         total_defense = co_defense + terrain_defense
-        debug_log("total defense:", total_defense)
+        instrument.count_dist("defense_rating", total_defense)
         return total_defense
 
     def base_damage_to(self, other):
@@ -618,47 +719,50 @@ class Unit:
         other_index = other.data.type.value - 1
         return DAMAGE_MATRIX[my_index][other_index]
 
-    def damage_to(self, other):
-        debug_log("damage to:", other)
-
-        base_damage = Dist.exactly(self.base_damage_to(other))
-        debug_log("base damage:", repr(base_damage))
-        co_attack = self.co.attack_for(self, (self.power or ATTACKER_POWER), other)
-        debug_log("co attack:", repr(co_attack))
-
-        co_adjusted_damage = (base_damage.scale(co_attack / 100)) + self.co.luck
-        hp_adjusted_damage = (self.displayed_hp.clamp(range(10)) / 10) * co_adjusted_damage
-        debug_log("adjusted damage", repr(hp_adjusted_damage))
-
-        defense_multiplier = other.defense_rating(self).transform(lambda v: (200 - v) / 100)
-        debug_log("defense multiplier:", repr(defense_multiplier))
-
-        raw_damage = hp_adjusted_damage * defense_multiplier
-        debug_log("raw damage:", repr(raw_damage))
-        final_damage = raw_damage.round_awars()
-        debug_log("final damage:", repr(final_damage))
-
-        return final_damage
-
-    def attack_with(self, *args):
+    def damage_key(self, other, meta=None):
+        """ Reduces an attack to the numbers the damage formula actually uses.
+
+            CO hooks are evaluated here (they are cheap scalars), so the key is
+            correct no matter which unit properties or meta values a hook reads.
+        """
+        return self.attack_key(other, meta) + (tuple(other.displayed_hp._buckets),)
+
+    def attack_key(self, other, meta=None):
+        """ The damage_key without the defender's hp, which is the last item of a damage_key. """
+        meta = meta or current_meta()
+        co_attack = self.co.attack_for(self, (self.power or meta.attacker_power), other, meta)
+        co_defense = other.co.defense_for(other, (other.power or meta.defender_power), self, meta)
+        terrain_stars = None if other.is_air else other.terrain.defense
+        return (self.base_damage_to(other), co_attack, self.co.luck, tuple(self.displayed_hp._buckets),
+                co_defense, terrain_stars)
+
+    def damage_to(self, other, meta=None):
+        with instrument.span("damage_to.co_boost"):
+            key = self.damage_key(other, meta)
+        return cached_damage(key)
+
+    def attack_with(self, *args, meta=None):
         if not args:
             return self
         other, *remaining = args
+        meta = meta or current_meta()
 
         if isinstance(other, int):
-            return self.truncate_hp(other).attack_with(*remaining)
+            return self.truncate_hp(other).attack_with(*remaining, meta=meta)
 
-        total_new_raw_hp = Dist([])
-        for displayed_hp, chance in self.displayed_hp.normalize()._buckets:
+        branches = []
+        displayed_buckets = self.displayed_hp.normalize()._buckets
+        instrument.count("attack_with.branches", len(displayed_buckets))
+        for displayed_hp, chance in displayed_buckets:
             partial_self = self.truncate_hp(displayed_hp)
-            damage = other.damage_to(partial_self)
-            new_raw_hp = partial_self.raw_hp - damage
-            debug_log("displayed hp", displayed_hp, "has new raw hp:", repr(new_raw_hp))
-            total_new_raw_hp = total_new_raw_hp.vector_add(new_raw_hp)
-            debug_log("total raw hp is now:", repr(total_new_raw_hp))
-            debug_log()
-
-        return self.with_hp(total_new_raw_hp).attack_with(*remaining)
+            damage = other.damage_to(partial_self, meta)
+            with instrument.span("attack_with.subtract"):
+                branches.append(partial_self.raw_hp - damage)
+        with instrument.span("attack_with.mixture"):
+            total_new_raw_hp = Dist.mixture(branches)
+        instrument.count_dist("attack_with.raw_hp", total_new_raw_hp)
+
+        return self.with_hp(total_new_raw_hp).attack_with(*remaining, meta=meta)
     attack_With = attack_with
 
     def find_best_attack(self, *args):
@@ -674,10 +778,307 @@ class Unit:
     best_attack_with = find_best_attack
     find_attack_with = find_best_attack
 
+    def observe(self, attacker, displayed_hp, counter_hp=None, meta=None):
+        """ Updates this unit's hidden raw hp after watching an attack on it.
+
+            attacker hit this unit, which was then displayed with displayed_hp, or
+            None if that wasn't seen (e.g. in fog). If counter_hp is given, this
+            unit then counterattacked and left attacker displayed with counter_hp,
+            which weighs the displayed hp this unit might have. Once displayed_hp
+            is known the raw hp lies in a single band, so counter_hp only checks
+            that the observation is possible. Returns the unit with its posterior
+            raw hp.
+        """
+        meta = meta or current_meta()
+        after = self.attack_with(attacker, meta=meta)
+        if displayed_hp is None:
+            # only a survivor counterattacks
+            posterior = after if counter_hp is None else after.with_hp(after.raw_hp.truncate(range(1, 101)))
+        elif displayed_hp <= 0:
+            posterior = after.with_hp(after.raw_hp.truncate(range(after.raw_hp.values()[0], 1)))
+        else:
+            posterior = after.truncate_hp(displayed_hp)
+
+        if counter_hp is not None:
+            # likelihood of the observed counter for each displayed hp this unit might have
+            likelihood = {}
+            for band, _ in posterior.displayed_hp._buckets:
+                countered = attacker.attack_with(posterior.truncate_hp(band), meta=meta)
+                likelihood[band] = sum(c for v, c in countered.displayed_hp._buckets
+                                       if v == counter_hp or (counter_hp <= 0 and v <= 0))
+            posterior = posterior.with_hp(Dist([(v, c * likelihood[math.ceil(v / 10)])
+                                                for v, c in posterior.raw_hp._buckets
+                                                if likelihood[math.ceil(v / 10)]]))
+
+        total = sum(c for v, c in posterior.raw_hp._buckets)
+        if not total:
+            raise Exception("Observation is impossible for " + repr(self) + ": "
+                            + repr((attacker, displayed_hp, counter_hp)))
+        # normalize by the exact total, since Dist.normalize rounds it
+        return posterior.with_hp(Dist([(v, c / total) for v, c in posterior.raw_hp._buckets]))
+
+    def observe_all(self, events, meta=None):
+        """ Applies observe() for each (attacker, displayed_hp[, counter_hp]) event in order. """
+        unit = self
+        for event in events:
+            unit = unit.observe(*event, meta=meta)
+        return unit
+
 def format_attackers(attackers):
     return "[" + ", ".join(attacker.short_repr() for attacker in attackers) + "]"
 
 
+TurnPlan = namedtuple("TurnPlan", ["score", "assignments"])
+Assignment = namedtuple("Assignment", ["defender", "attackers", "result"])
+
+GUARANTEED = 1 - 1e-9
+
+def _turn_score(defender, result, objective):
+    """ Scores one defender's outcome as a tuple so that scores can be summed and compared. """
+    return _outcome_score(defender, result.displayed_hp.clamp(range(10)).mean(), result.ko_chance, objective)
+
+def _outcome_score(defender, end_hp, ko_chance, objective):
+    """ The _turn_score of an outcome with expected displayed hp end_hp (clamped to 0-9) and KO chance ko_chance. """
+    start_hp = defender.displayed_hp.clamp(range(10)).mean()
+    value = defender.data.cost * (start_hp - end_hp) / 10
+    if objective == "value":
+        return (value,)
+    elif objective == "kos":
+        return (1 if ko_chance >= GUARANTEED else 0, ko_chance, value)
+    raise Exception("Unknown objective: " + repr(objective))
+
+def _add_scores(a, b):
+    return tuple(x + y for x, y in zip(a, b))
+
+def _clearly_worse(score, other):
+    """ Whether score is lower than other by more than rounding. """
+    for a, b in zip(score, other):
+        if abs(a - b) > 1e-9 * max(1, abs(a), abs(b)):
+            return a < b
+    return False
+
+def _hardest_damage(attacker, defender, meta):
+    """ A damage distribution that is at least as hard as attacker's on defender at any hp.
+
+        Its chance of dealing at least each amount is the highest of any of
+        defender's displayed hp, so it bounds every attack stochastically.
+    """
+    by_hp = [attacker.damage_to(defender.with_hp(hp), meta).normalize() for hp in range(1, 11)]
+    values = sorted({v for damage in by_hp for v, c in damage._buckets})
+    at_least = [max(sum(c for v, c in damage._buckets if v >= value) for damage in by_hp) for value in values]
+    return Dist([(v, c - following) for v, c, following in zip(values, at_least, at_least[1:] + [0])
+                 if c > following])
+
+def _defender_options(defender, attackers, objective, meta):
+    """ Finds the best ordering of every subset of attackers against one defender.
+
+        Returns {mask: (score, order, result)}. Orderings share their prefixes and
+        reach the same attack states through duplicate attackers only once. Once a
+        subset guarantees the KO, no superset can score higher, so it is not expanded.
+        Nor is an ordering whose every extension scores no better than the options
+        already found, even if each further attacker hit as hard as it could at any hp.
+    """
+    empty_score = _turn_score(defender, defender, objective)
+    options = {0: (empty_score, (), defender)}
+    maxed = []
+    seen = set()
+    # each attacker's damage at the defender's hardest-hit hp, and what subsets of attackers could do with it
+    hardest = [_hardest_damage(attacker, defender, meta) for attacker in attackers]
+    everyone = (1 << len(attackers)) - 1
+    subset_damage = {}
+    outlooks = {}
+
+    def damage_of(subset):
+        if subset not in subset_damage:
+            low = subset & -subset
+            rest = subset & ~low
+            damage = hardest[low.bit_length() - 1]
+            subset_damage[subset] = damage if not rest else (damage + damage_of(rest)).normalize()
+        return subset_damage[subset]
+
+    def outlook(subset):
+        """ The expected clamped displayed hp and KO chance after subset hits raw hp 1 to 100 as hard as it can. """
+        if subset not in outlooks:
+            damage = damage_of(subset)
+            values = damage.values()
+            at_most = [0] + list(accumulate(c for v, c in damage._buckets))
+            chance_at_most = lambda x: at_most[bisect.bisect_right(values, x)]
+            outlooks[subset] = [None] + [(sum(chance_at_most(hp - 10 * k + 9) for k in range(1, 10)),
+                                          1 - chance_at_most(hp - 1)) for hp in range(1, 101)]
+        return outlooks[subset]
+
+    def can_improve(result, mask):
+        """ Whether some extension of an ordering that reached result might beat the options found so far. """
+        total = sum(c for v, c in result.raw_hp._buckets)
+        rest = everyone & ~mask
+        subset = rest
+        while subset:
+            new_mask = mask | subset
+            if not any(m & new_mask == m for m in maxed):
+                if new_mask not in options:
+                    return True
+                table = outlook(subset)
+                end_hp = sum(c * table[v][0] for v, c in result.raw_hp._buckets if v > 0) / total
+                ko_chance = sum(c if v <= 0 else c * table[v][1] for v, c in result.raw_hp._buckets) / total
+                if not _clearly_worse(_outcome_score(defender, end_hp, ko_chance, objective), options[new_mask][0]):
+                    return True
+            subset = (subset - 1) & rest
+        return False
+
+    def visit(unit, mask, order):
+        for i, attacker in enumerate(attackers):
+            bit = 1 << i
+            if mask & bit:
+                continue
+            new_mask = mask | bit
+            if any(m & new_mask == m for m in maxed):
+                continue
+            result = unit.attack_with(attacker, meta=meta)
+            state = (new_mask, tuple(result.raw_hp._buckets))
+            if state in seen:
+                continue
+            seen.add(state)
+            new_order = order + (i,)
+            score = _turn_score(defender, result, objective)
+            if new_mask not in options or score > options[new_mask][0]:
+                options[new_mask] = (score, new_order, result)
+            if result.ko_chance >= GUARANTEED:
+                maxed.append(new_mask)
+            elif can_improve(result, new_mask):
+                visit(result, new_mask, new_order)
+            else:
+                instrument.count("plan_turn.pruned")
+
+    visit(defender, 0, ())
+    instrument.count("plan_turn.states", len(seen))
+    return options
+
+def plan_turn(attackers, defenders, objective="value", meta=None):
+    """ Assigns and orders attackers across several defenders.
+
+        objective="value" maximizes the expected funds destroyed (by UnitData.cost)
+        and objective="kos" maximizes guaranteed KOs, then expected KOs, then value.
+        Attackers may be left idle if they can't add anything.
+    """
+    attackers = list(attackers)
+    defenders = list(defenders)
+    meta = meta or current_meta()
+    all_options = [_defender_options(d, attackers, objective, meta) for d in defenders]
+
+    # best[mask] is the best (score, per-defender masks) using exactly the attackers in mask
+    zero = tuple(0 for _ in all_options[0][0][0]) if defenders else (0,)
+    best = {0: (zero, ())}
+    for options in all_options:
+        new_best = {}
+        for used, (score, masks) in best.items():
+            for mask, (option_score, _, _) in options.items():
+                if used & mask:
+                    continue
+                combined = used | mask
+                total = _add_scores(score, option_score)
+                if combined not in new_best or total > new_best[combined][0]:
+                    new_best[combined] = (total, masks + (mask,))
+        best = new_best
+
+    score, masks = max(best.values())
+    assignments = []
+    for defender, options, mask in zip(defenders, all_options, masks):
+        _, order, result = options[mask]
+        assignments.append(Assignment(defender, [attackers[i] for i in order], result))
+    return TurnPlan(score, assignments)
+
+def print_plan(plan):
+    for assignment in plan.assignments:
+        print(assignment.defender.short_repr() + " <- " + format_attackers(assignment.attackers)
+              + ": " + repr(assignment.result.displayed_hp.clamp(range(10))))
+    print("score: " + ", ".join("{:.2f}".format(s) for s in plan.score))
+
+
+RosterOption = namedtuple("RosterOption", ["cost", "ko_chance", "attackers", "result"])
+
+def _ko_bound(unit, damage):
+    """ The chance that unit's raw hp is at most damage, an upper bound on the KO chance after that much damage. """
+    total = sum(c for v, c in unit.raw_hp._buckets)
+    return sum(c for v, c in unit.raw_hp._buckets if v <= damage) / total
+
+def cheapest_roster(defender, target=0.9, units=None, co=None, power=None, max_attackers=4, max_cost=None,
+                    meta=None):
+    """ Finds the cheapest attackers that KO defender with at least target probability.
+
+        Attackers are drawn, with repeats, from units (by default ALL_UNITS that
+        can damage the defender), after applying co and power if given. Rosters
+        are searched in increasing total UnitData.cost and each is scored by its
+        best attack order. Returns the Pareto frontier of cost against KO chance
+        as RosterOptions, ending with the cheapest roster that reaches target
+        (if any does within max_attackers and max_cost).
+
+        Attack orders that reach the same hp with the same attackers are only
+        expanded once. An order is dropped when even max_attackers hits of the
+        hardest possible damage couldn't beat the best KO chance already found.
+    """
+    meta = meta or current_meta()
+    candidates = []
+    for unit in (ALL_UNITS if units is None else units):
+        if co is not None:
+            unit = unit.with_co(co)
+        if power is not None:
+            unit = unit.with_power(power)
+        if unit.base_damage_to(defender):
+            candidates.append(unit)
+    candidates.sort(key=lambda unit: unit.data.cost)
+
+    # the most damage any candidate can deal in one attack, at any hp the defender might have
+    max_hit = max([unit.damage_to(defender.with_hp(hp), meta).values()[-1]
+                   for unit in candidates for hp in range(1, 11)], default=0)
+
+    frontier = []
+    best_ko = defender.ko_chance
+    stop_cost = None
+    seen = set()
+    steps = {}
+    heap = [(0, 0, (), (), defender)]
+    pushed = 1
+    while heap:
+        cost, _, roster, order, unit = heapq.heappop(heap)
+        if stop_cost is not None and cost > stop_cost:
+            break
+        state = (roster, tuple(unit.raw_hp._buckets))
+        if state in seen:
+            continue
+        seen.add(state)
+
+        ko_chance = unit.ko_chance
+        if ko_chance > best_ko:
+            best_ko = ko_chance
+            option = RosterOption(cost, ko_chance, [candidates[i] for i in order], unit)
+            if frontier and frontier[-1].cost == cost:
+                frontier[-1] = option
+            else:
+                frontier.append(option)
+            if ko_chance >= target:
+                stop_cost = cost
+        if stop_cost is not None or ko_chance >= GUARANTEED or len(order) >= max_attackers:
+            continue
+        if _ko_bound(unit, (max_attackers - len(order)) * max_hit) <= best_ko:
+            continue
+
+        for i, attacker in enumerate(candidates):
+            new_cost = cost + attacker.data.cost
+            if max_cost is not None and new_cost > max_cost:
+                break
+            key = (state[1], i)
+            if key not in steps:
+                steps[key] = unit.attack_with(attacker, meta=meta)
+            heapq.heappush(heap, (new_cost, pushed, tuple(sorted(roster + (i,))), order + (i,), steps[key]))
+            pushed += 1
+    instrument.count("cheapest_roster.states", len(seen))
+    return frontier
+
+def print_rosters(frontier):
+    for option in frontier:
+        print("{:>6} {:>7.2%} ".format(option.cost, option.ko_chance) + format_attackers(option.attackers))
+
+
 def pretty_print(units):
     for unit in units:
         print(unit.with_hp(unit.displayed_hp.clamp(range(10))))
@@ -704,20 +1105,162 @@ def print_table(rows):
         print(row_format.format(*row))
 
 
-def compare_damage(*attackers, defenders=None, prune=True):
+def damage_rows(*attackers, defenders=None, prune=True):
+    """ Yields a header and then each defender's minimum damage from every attacker.
+
+        Rows are computed as they're requested, and each damage is computed once
+        for both the prune check and the row.
+    """
     if defenders is None:
         defenders = ALL_UNITS
-    if prune:
-        defenders = [d for d in defenders if all(a.damage_to(d)[0] > 0 for a in attackers)]
-    header = [""] + [attacker.type.name for attacker in attackers]
-    rows = [header]
+    yield [""] + [attacker.type.name for attacker in attackers]
     for unit in defenders:
-        row = [unit.type.name] + [str(attacker.damage_to(unit)[0]) for attacker in attackers]
-        rows.append(row)
-    print_table(rows)
+        damages = [attacker.damage_to(unit)[0] for attacker in attackers]
+        if prune and not all(damage > 0 for damage in damages):
+            continue
+        yield [unit.type.name] + damages
+
+def compare_damage(*attackers, defenders=None, prune=True):
+    print_table([[str(cell) for cell in row] for row in damage_rows(*attackers, defenders=defenders, prune=prune)])
     # print("\n".join("\t".join(col for col in row) for row in rows))
 
 
+def _table_cell(value):
+    if isinstance(value, TerrainData):
+        return value.type.name
+    elif isinstance(value, tuple):
+        return "/".join(str(_table_cell(v)) for v in value)
+    elif isinstance(value, Enum):
+        return value.name
+    return value
+
+
+class SweepResult:
+    """ The values of a sweep as nested lists indexed in the order of axes. """
+
+    def __init__(self, axes, values):
+        self.axes = axes
+        self.values = values
+
+    @property
+    def shape(self):
+        return tuple(len(values) for _, values in self.axes)
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        value = self.values
+        for i in index:
+            value = value[i]
+        return value
+
+    def rows(self):
+        """ Yields ({axis name: axis value}, value) for every point in the grid. """
+        names = [name for name, _ in self.axes]
+        for index in product(*[range(len(values)) for _, values in self.axes]):
+            point = {name: values[i] for name, (_, values), i in zip(names, self.axes, index)}
+            yield point, self[index]
+
+    def table(self):
+        """ Yields a header and then one row per grid point, for printing or export. """
+        names = [name for name, _ in self.axes]
+        yield names + ["value"]
+        for point, value in self.rows():
+            yield [_table_cell(point[name]) for name in names] + [value]
+
+    def __repr__(self):
+        return "SweepResult(" + ", ".join(name + "=" + str(len(values)) for name, values in self.axes) + ")"
+
+
+SWEEP_METRICS = {
+    "ko": lambda before, after: after.ko_chance,
+    "damage": lambda before, after: before.raw_hp.mean() - after.raw_hp.mean(),
+    "hp": lambda before, after: after.displayed_hp.clamp(range(10)).mean(),
+}
+
+def _set_nested(values, index, value):
+    for i in index[:-1]:
+        values = values[i]
+    values[index[-1]] = value
+
+def _empty_nested(shape):
+    if not shape:
+        return None
+    return [_empty_nested(shape[1:]) for _ in range(shape[0])]
+
+def _sweep_step(raw_hp, attack_key, steps):
+    """ Unit.attack_with on bare raw hp, for an attack reduced to its attack_key. """
+    key = (tuple(raw_hp._buckets), attack_key)
+    if key not in steps:
+        branches = []
+        for band, _ in (raw_hp / 10).round_up().normalize()._buckets:
+            partial = raw_hp.truncate(range((band - 1) * 10 + 1, band * 10 + 1))
+            defender_hp = tuple((partial / 10).round_up().normalize()._buckets)
+            branches.append(partial - cached_damage(attack_key + (defender_hp,)))
+        steps[key] = Dist.mixture(branches)
+    return steps[key]
+
+def sweep(defender, attackers, metric="ko", towers=None, dtowers=None, powers=None,
+          attacker_hp=None, defender_hp=None, cities=None, terrains=None, meta=None):
+    """ Evaluates defender.attack_with(*attackers) over a grid of scenarios.
+
+        Every axis that is given becomes a dimension of the result, in the order
+        of the arguments above. powers is a list of (attacker_power, defender_power)
+        pairs, the hp axes are displayed hp applied to all attackers or to the
+        defender, and terrains move the defender. Axes that aren't swept come from
+        meta (or the current meta). If dtowers isn't swept it follows towers, like
+        set_meta. metric is "ko", "damage", "hp" or f(defender, result).
+
+        Each grid point is reduced to its starting defender and the attack_key of
+        every attack, evaluating the CO hooks once per attack rather than once
+        per hp band. Points that reduce to the same attack chain (e.g. cities for
+        anyone but Kindle, or dtowers for anyone but Javier) are evaluated once,
+        and chains that share a prefix share its steps. This assumes that CO hooks
+        don't read the defender's hp, which none of the built-in COs do.
+    """
+    base = meta or current_meta()
+    metric = SWEEP_METRICS.get(metric, metric)
+    attackers = list(attackers)
+    axes = [(name, list(values)) for name, values in [
+                ("towers", towers), ("dtowers", dtowers), ("powers", powers), ("attacker_hp", attacker_hp),
+                ("defender_hp", defender_hp), ("cities", cities), ("terrains", terrains)]
+            if values is not None]
+
+    chains = {}
+    steps = {}
+    values = _empty_nested([len(v) for _, v in axes])
+    for index in product(*[range(len(v)) for _, v in axes]):
+        point = {name: v[i] for (name, v), i in zip(axes, index)}
+        point_towers = point.get("towers", base.towers)
+        attacker_power, defender_power = point.get("powers", (base.attacker_power, base.defender_power))
+        point_meta = Meta(point_towers, point.get("dtowers", point_towers if "towers" in point else base.dtowers),
+                          attacker_power, defender_power, point.get("cities", base.cities))
+
+        unit = defender
+        if "terrains" in point:
+            unit = unit.with_terrain(point["terrains"])
+        if "defender_hp" in point:
+            unit = unit.with_hp(point["defender_hp"])
+        attack_keys = []
+        for attacker in attackers:
+            if "attacker_hp" in point:
+                attacker = attacker.with_hp(point["attacker_hp"])
+            attack_keys.append(attacker.attack_key(unit, point_meta))
+
+        chain = (unit.data, unit.co, unit.power, unit.terrain, tuple(unit.raw_hp._buckets), tuple(attack_keys))
+        if chain not in chains:
+            instrument.count("sweep.chain_miss")
+            raw_hp = unit.raw_hp
+            for attack_key in attack_keys:
+                raw_hp = _sweep_step(raw_hp, attack_key, steps)
+            chains[chain] = metric(unit, unit.with_hp(raw_hp))
+        if index:
+            _set_nested(values, index, chains[chain])
+        else:
+            values = chains[chain]
+    return SweepResult(axes, values)
+
+
 ALL_UNITS = [Unit(ut) for ut in UnitType]
 
 # Convenience Variables
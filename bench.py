@@ -0,0 +1,204 @@
+""" Benchmarks for dist.py and awars.py.
+
+    $ python bench.py                          # run and print timings
+    $ python bench.py --save baseline.json     # record a baseline
+    $ python bench.py --compare baseline.json  # flag regressions against it
+    $ python bench.py -k attack_with           # only run matching benchmarks
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from awars import *
+
+BENCHMARKS = []
+
+
+def benchmark(name, repeat=5):
+    def register(f):
+        BENCHMARKS.append((name, repeat, f))
+        return f
+    return register
+
+
+@benchmark("dice.sum_60d6")
+def bench_dice_sum():
+    return 60 * d6
+
+
+@benchmark("dice.sum_20d20")
+def bench_dice_sum_d20():
+    return 20 * d20
+
+
+@benchmark("dice.advantage_chain")
+def bench_advantage_chain():
+    result = d20
+    for _ in range(50):
+        result = result.advantage(d20)
+    return result
+
+
+@benchmark("dist.sum_of_1000_checks", repeat=3)
+def bench_sum_of_checks():
+    return Dist.sum_of([(d20 + k % 15).pass_fail(15) for k in range(1000)])
+
+
+@benchmark("dist.sum_of_3000_normalized", repeat=3)
+def bench_sum_of_normalized_checks():
+    return Dist.sum_of([(d20 + k % 15).pass_fail(15).normalize() for k in range(3000)])
+
+
+@benchmark("dist.normalize_wide")
+def bench_normalize_wide():
+    return Dist.uniform(range(100000)).normalize()
+
+
+@benchmark("dist.to_cdf_wide")
+def bench_to_cdf_wide():
+    return Dist.uniform(range(100000)).to_cdf()
+
+
+ATTACKERS = [tank, md, arti, inf, mech, aa, bcopter]
+
+for _n in range(1, 6):
+    @benchmark("awars.attack_with_" + str(_n))
+    def bench_attack_with(n=_n):
+        return neo(city).attack_with(*ATTACKERS[:n])
+
+for _n, _repeat in [(5, 3), (6, 1), (7, 1)]:
+    @benchmark("awars.find_best_attack_" + str(_n), repeat=_repeat)
+    def bench_find_best_attack(n=_n):
+        with contextlib.redirect_stdout(io.StringIO()):
+            neo(city).find_best_attack(*ATTACKERS[:n])
+
+
+@benchmark("awars.compare_damage_all")
+def bench_compare_damage():
+    with contextlib.redirect_stdout(io.StringIO()):
+        compare_damage(*ALL_UNITS, prune=False)
+
+
+@benchmark("awars.battle_10_rounds")
+def bench_battle():
+    return battle(tank, md, rounds=10)
+
+
+class _CountingInit:
+    """ Temporarily wraps Dist.__init__ to count allocations. """
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        self.original = Dist.__init__
+        original = self.original
+
+        def counting_init(dist_self, buckets):
+            self.count += 1
+            original(dist_self, buckets)
+        Dist.__init__ = counting_init
+        return self
+
+    def __exit__(self, *exc_info):
+        Dist.__init__ = self.original
+
+
+def run_benchmark(f, repeat):
+    """ Returns the best wall time, peak traced memory and Dist allocations.
+
+        Timing runs are kept separate from the tracing run so that neither
+        tracemalloc nor the allocation counter skews the timings. Every run
+        starts from an empty damage cache, so awars benchmarks measure the
+        damage pipeline rather than cache hits left by earlier runs.
+    """
+    times = []
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+
+    clear_caches()
+    with _CountingInit() as counter:
+        tracemalloc.start()
+        try:
+            f()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {"seconds": min(times), "peak_bytes": peak, "dists": counter.count}
+
+
+def run_all(pattern=None):
+    results = {}
+    for name, repeat, f in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        result = run_benchmark(f, repeat)
+        results[name] = result
+        print("{:<28} {:>10.2f} ms {:>10.1f} KiB {:>9} dists".format(
+            name, result["seconds"] * 1000, result["peak_bytes"] / 1024, result["dists"]))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Prints a comparison against the baseline and returns the regressions. """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print("{:<28} (no baseline)".format(name))
+            continue
+        old = baseline[name]
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] else 1.0
+        flags = []
+        if ratio > 1 + threshold:
+            flags.append("TIME")
+        if result["peak_bytes"] > old["peak_bytes"] * (1 + threshold):
+            flags.append("MEMORY")
+        if result["dists"] > old["dists"] * (1 + threshold):
+            flags.append("DISTS")
+        if flags:
+            regressions.append((name, flags))
+        print("{:<28} {:>7.2f}x time {:>7.2f}x memory {:>7.2f}x dists {}".format(
+            name, ratio,
+            result["peak_bytes"] / old["peak_bytes"] if old["peak_bytes"] else 1.0,
+            result["dists"] / old["dists"] if old["dists"] else 1.0,
+            " ".join("REGRESSION:" + flag for flag in flags)))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="pattern", help="only run benchmarks whose name contains this string")
+    parser.add_argument("--save", metavar="FILE", help="write results to a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare results with a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown that counts as a regression (default 0.10)")
+    args = parser.parse_args(argv)
+
+    results = run_all(args.pattern)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(), "results": results}, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n{} regression(s) beyond {:.0%}".format(len(regressions), args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
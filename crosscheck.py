@@ -0,0 +1,256 @@
+""" Cross-checks a Dist backend against the reference backend.
+
+    $ python crosscheck.py                     # check the fast backend on every operation
+    $ python crosscheck.py --cases 500 --seed 3
+    $ python crosscheck.py --sample 0.1        # only check a tenth of the operations
+    $ python crosscheck.py -k awars            # only run matching cases
+
+    The corpus is the examples from the Readme, awars scenarios, and randomly
+    built distributions and attacks. Each case runs once on the reference
+    backend and once under set_backend(backend, check="reference"), which
+    raises on the first operation that disagrees. The final results of the two
+    runs are compared as well.
+"""
+import argparse
+import random
+import sys
+
+import awars
+from awars import *
+
+CASES = []
+
+
+def case(name):
+    def register(f):
+        CASES.append((name, f))
+        return f
+    return register
+
+
+@case("readme.dice")
+def readme_dice():
+    return [d6 + 1, d6 + d6, 2 * d6, (2 * d6 + 3).normalize(), (10 * d6).normalize().rebin(4, "quantile")]
+
+
+@case("readme.checks")
+def readme_checks():
+    return [(d20 + 5).pass_fail(17).normalize(), (d20 + 5).advantage().pass_fail(17).normalize(),
+            (d20 + 5).prob_gt(d20 + 3), (d20 + 5).compare_many([d20 + 3, 10])]
+
+
+@case("readme.attacks")
+def readme_attacks():
+    to_hit = (d20 + 5).pass_fail(14)
+    damage = 2 * d6 + 3
+    return [(to_hit * damage).normalize(),
+            to_hit.normalize().bind(lambda hit: damage.normalize() if hit else Dist.zero()),
+            Dist.mixture([(0.4, d6.normalize()), (0.6, Dist.zero())])]
+
+
+@case("readme.successes")
+def readme_successes():
+    return [Dist.successes([0.65, 0.5, 0.3]),
+            Dist.sum_of([(d20 + 7).pass_fail(15), (d20 + 7).pass_fail(15), (d20 + 4).pass_fail(15)]).normalize()]
+
+
+@case("readme.generating_functions")
+def readme_generating_functions():
+    return [Dist.exploding(d6, depth=1).normalize(), (2 * Dist.reroll(d6, {1, 2})).normalize(),
+            Dist.until(d20 + 5, 17).normalize(), Dist.repeat(d4, d6)]
+
+
+@case("dist.wide_generating_functions")
+def wide_generating_functions():
+    rng = random.Random(0)
+    return [Dist.successes([rng.random() for _ in range(300)]),
+            Dist.sum_of([(d20 + k % 15).pass_fail(15).normalize() for k in range(300)]),
+            Dist.exploding(Dist.d(100).normalize(), depth=3), Dist.reroll(Dist.d(100).normalize(), set(range(1, 20))),
+            Dist.repeat(Dist.d(20), d20)]
+
+
+@case("readme.awars")
+def readme_awars():
+    return [tank(city).attack_with(tank, tank, inf), tank(city).attack_with(tank, tank, aa),
+            tank(city).attack_with(tank, tank, meta=make_meta(3)),
+            tank(plains).attack_with(inf(5)).with_terrain(city).attack_with(tank, tank)]
+
+
+@case("readme.planning")
+def readme_planning():
+    plan = plan_turn([tank, md, arti, inf, mech, bcopter], [tank(city), md(forest), arti(plains)], objective="kos")
+    return [plan.score, [assignment.result for assignment in plan.assignments],
+            cheapest_roster(neo(city), target=0.9)]
+
+
+@case("readme.sweeps")
+def readme_sweeps():
+    return [sweep(tank(city), [tank, tank], towers=range(4)).values,
+            sweep(neo, [md, tank], towers=range(3), terrains=[plains, city], defender_hp=range(1, 11)).values]
+
+
+@case("readme.observe")
+def readme_observe():
+    return [md(plains).observe(md, None, counter_hp=8), md(plains).observe(md, None, counter_hp=7),
+            md(forest).observe_all([(tank, 9, 2), (arti, 5), (inf(7), 5)])]
+
+
+@case("awars.damage_rows")
+def awars_damage_rows():
+    return [row[1:] for row in damage_rows(*ALL_UNITS, prune=False)][1:]
+
+
+@case("awars.battle")
+def awars_battle():
+    return battle(tank, md, rounds=6)
+
+
+@case("awars.cos")
+def awars_cos():
+    results = []
+    for co in CO_CHOICES:
+        for power in PowerType:
+            results.append(tank(co, power).attack_with(md(co), arti(co, power)))
+    return results
+
+
+CO_CHOICES = [CommandingOfficer()] + [value for name, value in sorted(vars(awars).items())
+                                      if isinstance(value, CommandingOfficer)]
+
+
+def random_dist(rng):
+    kind = rng.randrange(5)
+    if kind == 0:
+        return Dist.d(rng.choice([2, 4, 6, 8, 10, 12, 20, 100]))
+    elif kind == 1:
+        return Dist([(rng.randint(-20, 40), rng.randint(1, 50)) for _ in range(rng.randint(1, 30))])
+    elif kind == 2:
+        return Dist([(rng.randint(-20, 40), rng.randint(1, 50)) for _ in range(rng.randint(1, 30))]).normalize()
+    elif kind == 3:
+        return Dist([(rng.uniform(-10, 10), rng.random()) for _ in range(rng.randint(1, 30))])
+    # wide enough for the vectorized projections and NumPy series products
+    return (rng.randint(10, 25) * Dist.d(rng.choice([12, 20]))).normalize()
+
+
+def random_step(rng, d):
+    other = random_dist(rng)
+    small = len(d._buckets) * len(other._buckets) <= 20000
+    steps = [
+        lambda: d + rng.randint(-5, 5),
+        lambda: (d / rng.choice([3, 7, 10])).round_awars(),
+        lambda: (d / rng.choice([3, 7, 10])).round_up(),
+        lambda: (d / rng.choice([3, 7, 10])).round_down(),
+        lambda: d.pass_fail(rng.randint(-5, 20), pass_val=rng.choice([1, -1])),
+        lambda: d.clamp(range(rng.randint(-10, 0), rng.randint(1, 30))),
+        lambda: d.transform(lambda v: (200 - v) / 100, lambda a: (200 - a) / 100),
+        lambda: d.transform(lambda v: v % 7),
+        lambda: Dist.mixture([(rng.random(), d), (rng.random(), other)]),
+        lambda: d.normalize(),
+    ]
+    if small:
+        steps += [
+            lambda: d + other,
+            lambda: d - other,
+            lambda: d * other,
+            lambda: d.advantage(other),
+            lambda: d.disadvantage(other),
+            lambda: d.bind(lambda v: other + v if v > d.mean() else Dist.zero()),
+        ]
+    if len(d._buckets) <= 200:
+        steps.append(lambda: rng.randint(1, 4) * d)
+    return rng.choice(steps)()
+
+
+def random_dist_case(seed):
+    def run():
+        rng = random.Random(seed)
+        d = random_dist(rng)
+        results = [d]
+        for _ in range(rng.randint(1, 4)):
+            d = random_step(rng, d)
+            results.append(d)
+        return results
+    return run
+
+
+def random_attack_case(seed):
+    def run():
+        rng = random.Random(seed)
+        defender = rng.choice(ALL_UNITS)(rng.choice(list(TerrainType)), rng.choice(CO_CHOICES), rng.randint(1, 10))
+        attackers = [rng.choice(ALL_UNITS)(rng.choice(CO_CHOICES), rng.randint(1, 10))
+                     for _ in range(rng.randint(1, 3))]
+        meta = make_meta(rng.randint(0, 3), rng.randint(0, 3), rng.choice(list(PowerType)),
+                         rng.choice(list(PowerType)), cities=rng.randint(0, 10))
+        return defender.attack_with(*attackers, meta=meta)
+    return run
+
+
+def summarize(result):
+    """ Flattens a case's result into buckets that bucket_difference can compare. """
+    if isinstance(result, Dist):
+        return result._buckets
+    elif isinstance(result, Unit):
+        return result.raw_hp._buckets
+    elif isinstance(result, (int, float)):
+        return [(0, result)]
+    elif isinstance(result, (list, tuple)):
+        return [((i, v), c) for i, item in enumerate(result) for v, c in summarize(item)]
+    return []
+
+
+def run_case(f):
+    """ Runs a case from a clean damage cache, returning its summary and the error it raised, if any. """
+    awars.clear_caches()
+    try:
+        return summarize(f()), None
+    except Exception as e:
+        return [], str(e)
+
+
+def run_all(backend, cases, sample, tolerance):
+    failures = []
+    operations = checked = 0
+    for name, f in cases:
+        set_backend("reference")
+        expected, expected_error = run_case(f)
+        checker = set_backend(backend, check="reference", sample=sample, tolerance=tolerance, seed=0)
+        result, error = run_case(f)
+        operations += checker.operations
+        checked += checker.checked
+        if error != expected_error:
+            difference = error or "finished, but the reference raised: " + expected_error
+        else:
+            difference = bucket_difference(result, expected, tolerance)
+        if difference is not None:
+            failures.append((name, difference))
+            print("FAIL {}: {}".format(name, difference))
+    set_backend("reference")
+    print("{} cases, {} operations, {} checked against the reference, {} failures".format(
+        len(cases), operations, checked, len(failures)))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="fast", choices=sorted(BACKENDS))
+    parser.add_argument("--cases", type=int, default=200, help="random cases of each kind (default 200)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample", type=float, default=1.0, help="fraction of operations to check (default 1)")
+    parser.add_argument("--tolerance", type=float, default=1e-9)
+    parser.add_argument("-k", dest="pattern", help="only run cases whose name contains this string")
+    args = parser.parse_args(argv)
+
+    cases = list(CASES)
+    for i in range(args.cases):
+        seed = args.seed * args.cases + i
+        cases.append(("random.dist_" + str(seed), random_dist_case(seed)))
+        cases.append(("random.attack_" + str(seed), random_attack_case(seed)))
+    if args.pattern:
+        cases = [(name, f) for name, f in cases if args.pattern in name]
+
+    failures = run_all(args.backend, cases, args.sample, args.tolerance)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,40 @@
+import bisect
+import functools
+import heapq
+import itertools
 import math
 import operator
+import random
 from collections import Counter
 import statistics
+import weakref
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Distributions with more buckets than this are grouped into this many bins when printed.
+MAX_ROWS = 100
+
+# The fast backend convolves float series products at least this long on both sides
+# with NumPy, if it's installed.
+CONVOLVE_THRESHOLD = 64
+
+# The fast backend projects dists with at least this many buckets with NumPy, if it's installed.
+VECTORIZE_THRESHOLD = 256
+
+# When enabled, the simple constructors (zero, uniform, exactly, d) return shared
+# interned instances. Interned dists are only kept alive while something uses them.
+INTERNING = False
+_intern_pool = weakref.WeakValueDictionary()
+
+def set_interning(enabled=True):
+    global INTERNING
+    INTERNING = enabled
+
+def intern_pool_size():
+    return len(_intern_pool)
 
 # garbage formatting only print the decimals if necessary
 def format_c(c):
@@ -24,18 +57,66 @@ def align_rows(rows):
     aligned_cols = [align_column(col) for col in columns]
     return zip(*aligned_cols)
 
+def format_range(lo, hi):
+    f = lambda v: str(v) if isinstance(v, int) else format_c(v)
+    if lo == hi:
+        return f(lo)
+    return f(lo) + "-" + f(hi)
+
+def render_rows(labels, counts, c_formatters):
+    """ Renders aligned "label: formatted count" lines, one column at a time. """
+    if not labels:
+        return ""
+    columns = [[label + ":" for label in labels]] + [[f(c) for c in counts] for f in c_formatters]
+    widths = [max(len(v) for v in column) for column in columns]
+    row_format = " ".join("{:<" + str(width) + "}" for width in widths)
+    return "\n".join(row_format.format(*row) for row in zip(*columns))
+
 class Dist:
 
+    # "cdf" or "rcdf" for the output of to_cdf/to_rcdf, whose counts can't be summed into bins
+    _cumulative = None
+
     def __init__(self, buckets):
         self._buckets = list(sorted(buckets))
+        self._hash = None
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) != Dist:
+            return NotImplemented
+        return hash(self) == hash(other) and self._buckets == other._buckets
+
+    def __hash__(self):
+        # dists are never mutated, so the content hash is computed once
+        if self._hash is None:
+            self._hash = hash(tuple(self._buckets))
+        return self._hash
+
+    def intern(self):
+        """ Returns the canonical instance of this distribution from the intern pool.
+
+            Equal interned dists are the same object, so comparing them or using
+            them as cache keys only needs an identity check.
+        """
+        # 100 and 100.0 (or 1 and True) are equal but must not share an instance
+        key = tuple((type(v), v, type(c), c) for v, c in self._buckets)
+        canonical = _intern_pool.get(key)
+        if canonical is None:
+            _intern_pool[key] = canonical = self
+        return canonical
+
+    def _maybe_intern(self):
+        return self.intern() if INTERNING else self
 
     @staticmethod
     def zero():
-        return Dist([(0, 1)])
+        return Dist([(0, 1)])._maybe_intern()
 
     @staticmethod
     def uniform(r):
-        return Dist([(v, 1) for v in r])
+        return Dist([(v, 1) for v in r])._maybe_intern()
 
     @staticmethod
     def exactly(value):
@@ -49,15 +130,143 @@ class Dist:
     def from_lines(lines):
         return Dist(Counter(int(float(line)) for line in lines.split()).items())
 
+    @staticmethod
+    def exploding(die, depth=None, cutoff=1e-9):
+        """ Rolls die, rolling again and adding whenever it shows its highest value.
+
+            Explodes at most depth times, or if depth is None until the chance of
+            exploding again is below cutoff. For example, Dist.exploding(d6, depth=2)
+            can roll up to 6 + 6 + 6.
+        """
+        series = Series.from_dist(die)
+        top = die._buckets[-1]
+        rest = series - Series([top[1]], top[0])
+        return Series.recurrence(rest, top[1], top[0], series, depth, cutoff).to_dist()
+
+    @staticmethod
+    def reroll(die, rerolled, times=1, cutoff=1e-9):
+        """ Rolls die, rerolling results in rerolled up to times times (keeping the last roll).
+
+            For example, 2 * Dist.reroll(d6, {1, 2}) is great weapon fighting's
+            "reroll 1s and 2s once" on 2d6. times=None rerolls until a kept result.
+        """
+        series = Series.from_dist(die)
+        kept = Series.from_dist(Dist([(v, c) for v, c in die._buckets if v not in rerolled]))
+        weight = sum(c for v, c in die._buckets if v in rerolled)
+        return Series.recurrence(kept, weight, 0, series, times, cutoff).to_dist()
+
+    @staticmethod
+    def until(die, success, depth=None, cutoff=1e-9):
+        """ The number of times die is rolled, stopping at the first success or after depth rolls.
+
+            success is a threshold (like pass_fail) or a predicate on the rolled value.
+        """
+        if not callable(success):
+            threshold = success
+            success = lambda v: v >= threshold
+        hits = sum(c for v, c in die._buckets if success(v))
+        misses = sum(c for v, c in die._buckets if not success(v))
+        # one roll is made no matter what, and each recursion level adds another
+        levels = None if depth is None else depth - 1
+        return Series.recurrence(Series([hits], 1), misses, 1, Series([hits + misses], 1), levels, cutoff).to_dist()
+
+    @staticmethod
+    def repeat(count, die):
+        """ Sums a random number of rolls of die, e.g. Dist.repeat(d4, d6) rolls d4 d6s. """
+        roll = Series.from_dist(die)
+        return Series.from_dist(count).compose(roll * (1 / roll.total())).to_dist()
+
+    @staticmethod
+    def successes(chances):
+        """ The number of successes among independent checks with the given chances.
+
+            This is the Poisson binomial distribution. The per-check generating
+            functions are multiplied pairwise in a balanced tree, so most products
+            are small and thousands of checks stay fast. The fast backend also
+            convolves the large products with NumPy.
+        """
+        series = [Series([1 - p, p]) for p in chances]
+        if not series:
+            return Dist.zero()
+        while len(series) > 1:
+            paired = [a.multiply(b) for a, b in zip(series[::2], series[1::2])]
+            if len(series) % 2:
+                paired.append(series[-1])
+            series = paired
+        return series[0].to_dist()
+
+    @staticmethod
+    def sum_of(dists):
+        """ The sum of independent rolls of each of dists.
+
+            Components with float counts are grouped and summed by repeated
+            squaring, then the partial sums are combined smallest first so that
+            most products are small. Integer counts grow into big
+            integers, which are much cheaper to add one short component at a time
+            than to multiply as two long series, so those are folded in order.
+        """
+        dists = list(dists)
+        if not dists:
+            return Dist.zero()
+        exact = [d for d in dists if all(type(c) == int for v, c in d._buckets)]
+        inexact = [d for d in dists if not all(type(c) == int for v, c in d._buckets)]
+
+        partials = []
+        if exact and all(type(v) == int for d in exact for v, c in d._buckets):
+            total = Series.from_dist(exact[0])
+            for d in exact[1:]:
+                total = total.multiply(Series.from_dist(d))
+            partials.append(total.to_dist())
+        elif exact:
+            partials.append(functools.reduce(operator.add, exact))
+        if inexact:
+            heap = [(len(d._buckets), i, d) for i, d in enumerate(_power(d, n) for d, n in Counter(inexact).items())]
+            heapq.heapify(heap)
+            counter = len(heap)
+            while len(heap) > 1:
+                _, _, a = heapq.heappop(heap)
+                _, _, b = heapq.heappop(heap)
+                total = _convolve(a, b)
+                heapq.heappush(heap, (len(total._buckets), counter, total))
+                counter += 1
+            partials.append(heap[0][2])
+        return partials[0] if len(partials) == 1 else _convolve(*partials)
+
     def __repr__(self):
         f = lambda v: str(v) if v == int(v) else "{:0.4f}".format(v).rstrip("0").rstrip(".")
         return "Dist([" + ", ".join("(" + str(k) + ", " + f(v) + ")" for k, v in self._buckets) + "])"
 
     def __str__(self, c_formatters=None):
+        return self.render(c_formatters)
+
+    def render(self, c_formatters=None, max_rows=None):
+        """ Prints one row per bucket, or per bin if there are more than max_rows buckets. """
         if not c_formatters:
             c_formatters = [format_c]
-        rows = [[str(v) + ":"] + [f(c) for f in c_formatters] for v, c in self._buckets]
-        return "\n".join(" ".join(row) for row in align_rows(rows))
+        labels, counts = self._display_rows(max_rows)
+        return render_rows(labels, counts, c_formatters)
+
+    def _display_rows(self, max_rows=None):
+        max_rows = max_rows or MAX_ROWS
+        if len(self._buckets) <= max_rows:
+            return [str(v) for v, c in self._buckets], [c for v, c in self._buckets]
+        if not self._cumulative:
+            bins = self._bins(max_rows)
+            return [format_range(lo, hi) for lo, hi, c in bins], [c for lo, hi, c in bins]
+
+        # bin the underlying distribution, then show each bin's cumulative chance
+        counts = [c for v, c in self._buckets]
+        if self._cumulative == "cdf":
+            pmf = Dist([(v, c - prev) for (v, c), prev in zip(self._buckets, [0] + counts[:-1])])
+        else:
+            pmf = Dist([(v, c - following) for (v, c), following in zip(self._buckets, counts[1:] + [0])])
+        bins = pmf._bins(max_rows)
+        sums = [c for lo, hi, c in bins]
+        if self._cumulative == "cdf":
+            cumulative = list(itertools.accumulate(sums))
+        else:
+            cumulative = list(itertools.accumulate(reversed(sums)))[::-1]
+        return [format_range(lo, hi) for lo, hi, c in bins], cumulative
 
     def __len__(self):
         return round(sum(c for v, c in self._buckets))
@@ -81,24 +290,73 @@ class Dist:
     def values(self):
         return [v for (v, c) in self._buckets]
 
-    def _project(self, f):
+    def _bins(self, bins, method="width"):
+        """ Groups the buckets into bins, returning a list of (low, high, count).
+
+            "width" bins split the value range evenly (empty bins are kept) and
+            "quantile" bins hold roughly equal counts. Bin counts come from
+            differences of prefix sums, so this is linear in the number of buckets.
+        """
+        if bins < 1:
+            raise Exception("Need at least one bin: " + repr(bins))
+        if not self._buckets:
+            return []
+        values = [v for v, c in self._buckets]
+        prefix = [0]
+        prefix.extend(itertools.accumulate(c for v, c in self._buckets))
+
+        if method == "width":
+            lo, hi = values[0], values[-1]
+            integral = isinstance(lo, int) and isinstance(hi, int)
+            if integral:
+                width = max(1, math.ceil((hi - lo + 1) / bins))
+            else:
+                width = (hi - lo) / bins or 1
+            result = []
+            start = 0
+            for i in range(bins):
+                edge = lo + (i + 1) * width
+                end = len(values) if i == bins - 1 else bisect.bisect_left(values, edge, start)
+                bin_lo = lo + i * width
+                bin_hi = bin_lo + width - 1 if integral else edge
+                result.append((bin_lo, bin_hi, prefix[end] - prefix[start]))
+                start = end
+                if integral and edge > hi:
+                    break
+            return result
+        elif method == "quantile":
+            total = prefix[-1]
+            result = []
+            start = 0
+            for i in range(1, bins + 1):
+                end = len(values) if i == bins else bisect.bisect_left(prefix, total * i / bins, start + 1)
+                if end > start:
+                    result.append((values[start], values[end - 1], prefix[end] - prefix[start]))
+                    start = end
+            return result
+        raise Exception("Unknown binning method: " + repr(method))
+
+    def rebin(self, bins, method="width"):
+        """ Groups the buckets into at most `bins` buckets, each keyed by its lowest value.
+
+            method="width" uses evenly sized value ranges and method="quantile"
+            uses ranges with roughly equal counts.
+        """
+        return Dist([(lo, c) for lo, hi, c in self._bins(bins, method)])
+
+    def _project(self, f, vectorized=None, monotone=False):
         """ Projects this distribution into a new distribution by applying the
             function f to each bucket's value to find the corresponding
             "projected" bucket and adding the original bucket's count to the
             projected bucket's count.
+
+            vectorized (f over a NumPy array of values) and monotone (f never
+            decreases) are hints that let the backend take a faster path.
         """
-        combined = Counter()
-        for (v, c) in self._buckets:
-            combined[f(v)] += c
-        return Dist(combined.items())
+        return Dist(_backend.project(self._buckets, f, vectorized, monotone))
 
     def _combine(self, other, f):
-        combined = Counter()
-        for (v1, c1) in self._buckets:
-            for (v2, c2) in other._buckets:
-                new_val = f(v1, v2)
-                combined[new_val] += c1 * c2
-        return Dist(combined.items())
+        return Dist(_backend.combine(self._buckets, other._buckets, f))
 
     def __add__(self, other):
         if type(other) == Dist:
@@ -153,7 +411,32 @@ class Dist:
 
             This is in contrast with __add__ which simulates "rolling the dice" for each distribution.
         """
-        return Dist((Counter(dict(self._buckets)) + Counter(dict(other._buckets))).items())
+        return Dist.mixture([self, other])
+
+    @staticmethod
+    def mixture(components):
+        """ Sums many distributions directly in a single k-way merge of their buckets.
+
+            Each component is a Dist or a (weight, Dist) pair whose counts are
+            scaled by weight. Buckets whose total count isn't positive are dropped,
+            as with vector_add. For example, a 40% chance of d6 and otherwise 0:
+            Dist.mixture([(0.4, d6.normalize()), (0.6, Dist.zero())])
+        """
+        streams = []
+        for component in components:
+            if isinstance(component, Dist):
+                streams.append(component._buckets)
+            else:
+                weight, d = component
+                streams.append([(v, c * weight) for v, c in d._buckets])
+        return Dist(_backend.mixture(streams))
+
+    def bind(self, f):
+        """ Replaces each bucket's value v with the distribution f(v), weighted by its count.
+
+            This is branch-and-mix: e.g. to_hit.bind(lambda hit: damage if hit else Dist.zero())
+        """
+        return Dist.mixture([(c, f(v)) for v, c in self._buckets])
 
     def __truediv__(self, other):
         if type(other) == Dist:
@@ -178,7 +461,7 @@ class Dist:
                 return allowed_range.stop
             else:
                 return value
-        return self._project(clamp_to_range)
+        return self._project(clamp_to_range, monotone=True)
 
     def advantage(self, other=None):
         if not other:
@@ -191,10 +474,10 @@ class Dist:
         return self._combine(other, min)
 
     def round_down(self):
-        return self._project(math.floor)
+        return self._project(math.floor, lambda a: np.floor(a).astype(np.int64), monotone=True)
 
     def round_up(self):
-        return self._project(math.ceil)
+        return self._project(math.ceil, lambda a: np.ceil(a).astype(np.int64), monotone=True)
 
     def round_awars(self):
         """ Advance wars rounds 0.95 and higher up, but otherwise rounds down. """
@@ -203,13 +486,86 @@ class Dist:
             if fractional >= 0.95:
                 return math.ceil(n)
             return math.floor(n)
-        return self._project(awars_round)
+        def awars_round_array(a):
+            floor = np.floor(a)
+            return np.where(a - floor >= 0.95, np.ceil(a), floor).astype(np.int64)
+        return self._project(awars_round, awars_round_array, monotone=True)
 
     def pass_fail(self, threshold, force_fail=1, pass_val=1, fail_val=0):
-        return self._project(lambda v: pass_val if v >= threshold and v > force_fail else fail_val)
+        return self._project(lambda v: pass_val if v >= threshold and v > force_fail else fail_val,
+                             lambda a: np.where((a >= threshold) & (a > force_fail), pass_val, fail_val),
+                             monotone=pass_val >= fail_val)
 
-    def transform(self, f):
-        return self._project(f)
+    def _compare(self, other):
+        """ Returns the (greater, equal, total) pair counts of self vs other in one sweep.
+
+            This is O(n + m), where building (self - other) would be O(n * m).
+        """
+        if type(other) != Dist:
+            other = Dist.exactly(other)
+        xs = self._buckets
+        total_x = sum(c for v, c in xs)
+        total_y = sum(c for v, c in other._buckets)
+        below = 0
+        i = 0
+        greater = equal = 0
+        for y, cy in other._buckets:
+            while i < len(xs) and xs[i][0] < y:
+                below += xs[i][1]
+                i += 1
+            same = xs[i][1] if i < len(xs) and xs[i][0] == y else 0
+            greater += cy * (total_x - below - same)
+            equal += cy * same
+        return greater, equal, total_x * total_y
+
+    def prob_gt(self, other):
+        greater, equal, total = self._compare(other)
+        return greater / total
+
+    def prob_ge(self, other):
+        greater, equal, total = self._compare(other)
+        return (greater + equal) / total
+
+    def prob_eq(self, other):
+        greater, equal, total = self._compare(other)
+        return equal / total
+
+    def prob_lt(self, other):
+        greater, equal, total = self._compare(other)
+        return (total - greater - equal) / total
+
+    def prob_le(self, other):
+        greater, equal, total = self._compare(other)
+        return (total - greater) / total
+
+    def compare_many(self, others):
+        """ Returns [(P(self > o), P(self == o), P(self < o)) for o in others].
+
+            The cumulative counts of self are computed once and each opponent
+            bucket is located by bisection, so large opposed-check tables are cheap.
+        """
+        values = [v for v, c in self._buckets]
+        prefix = [0]
+        prefix.extend(itertools.accumulate(c for v, c in self._buckets))
+        total_x = prefix[-1]
+        results = []
+        for other in others:
+            if type(other) != Dist:
+                other = Dist.exactly(other)
+            total_y = sum(c for v, c in other._buckets)
+            greater = equal = 0
+            for y, cy in other._buckets:
+                lo = bisect.bisect_left(values, y)
+                hi = bisect.bisect_right(values, y, lo)
+                greater += cy * (total_x - prefix[hi])
+                equal += cy * (prefix[hi] - prefix[lo])
+            total = total_x * total_y
+            results.append((greater / total, equal / total, (total - greater - equal) / total))
+        return results
+
+    def transform(self, f, vectorized=None):
+        """ Applies f to every value. vectorized, if given, is the same function over NumPy arrays. """
+        return self._project(f, vectorized)
 
     def mean(self):
         total = 0
@@ -264,7 +620,9 @@ class Dist:
         for v, c in norm._buckets:
             cum_c += c
             buckets.append((v, cum_c))
-        return Dist(buckets)
+        cdf = Dist(buckets)
+        cdf._cumulative = "cdf"
+        return cdf
 
     def to_rcdf(self):
         norm = self.normalize()
@@ -273,12 +631,15 @@ class Dist:
         for v, c in reversed(norm._buckets):
             cum_c += c
             buckets.append((v, cum_c))
-        return Dist(buckets)
+        rcdf = Dist(buckets)
+        rcdf._cumulative = "rcdf"
+        return rcdf
 
-    def _graph(self, columns=None, extra_detail=None):
+    def _graph(self, columns=None, extra_detail=None, max_rows=None):
         if not columns:
             columns = 20
-        max_c = max(c for v, c in self._buckets)
+        labels, counts = self._display_rows(max_rows)
+        max_c = max(counts)
         cell_size = max_c / columns
         graph_format = lambda c : math.floor(c / cell_size) * "#"
 
@@ -287,13 +648,358 @@ class Dist:
         else:
             formatters = [graph_format]
 
-        return self.__str__(formatters) + "\neach # represents {:.4f}".format(cell_size)
+        return render_rows(labels, counts, formatters) + "\neach # represents {:.4f}".format(cell_size)
+
+    def graph(self, columns=None, max_rows=None):
+        return self._graph(columns, extra_detail=lambda c: "({:.4f})".format(c), max_rows=max_rows)
+
+    def details(self, columns=None, max_rows=None):
+        return self.graph(columns, max_rows) + "\n" + self.summary() + "\n"
+
+class Series:
+    """ A power series sum(c * x**(offset + i) for i, c in enumerate(coeffs)).
+
+        This is the generating function of a distribution over integers, where the
+        coefficient of x**v is the count for v. Adding two series mixes their
+        distributions, multiplying them sums independent rolls, and composing them
+        sums a random number of rolls. Products can be truncated to max_degree.
+    """
+
+    def __init__(self, coeffs, offset=0):
+        self.coeffs = list(coeffs)
+        self.offset = offset
+
+    @staticmethod
+    def from_dist(d):
+        if not d._buckets:
+            return Series([])
+        if any(not isinstance(v, int) for v, c in d._buckets):
+            raise Exception("Generating functions need integer values: " + repr(d))
+        offset = d._buckets[0][0]
+        coeffs = [0] * (d._buckets[-1][0] - offset + 1)
+        for v, c in d._buckets:
+            coeffs[v - offset] += c
+        return Series(coeffs, offset)
+
+    def to_dist(self):
+        return Dist([(self.offset + i, c) for i, c in enumerate(self.coeffs) if c])
+
+    def __repr__(self):
+        return "Series(" + repr(self.coeffs) + ", " + str(self.offset) + ")"
+
+    def total(self):
+        return sum(self.coeffs)
+
+    def shift(self, n):
+        return Series(self.coeffs, self.offset + n)
 
-    def graph(self, columns=None):
-        return self._graph(columns, extra_detail=lambda c: "({:.4f})".format(c))
+    def __add__(self, other):
+        if not self.coeffs:
+            return other
+        if not other.coeffs:
+            return self
+        offset = min(self.offset, other.offset)
+        coeffs = [0] * (max(self.offset + len(self.coeffs), other.offset + len(other.coeffs)) - offset)
+        for series in (self, other):
+            start = series.offset - offset
+            for i, c in enumerate(series.coeffs):
+                coeffs[start + i] += c
+        return Series(coeffs, offset)
+
+    def __sub__(self, other):
+        return self + other * -1
+
+    def __mul__(self, other):
+        if not isinstance(other, Series):
+            return Series([c * other for c in self.coeffs], self.offset)
+        return self.multiply(other)
+    __rmul__ = __mul__
+
+    def multiply(self, other, max_degree=None):
+        if not self.coeffs or not other.coeffs:
+            return Series([])
+        offset = self.offset + other.offset
+        size = len(self.coeffs) + len(other.coeffs) - 1
+        if max_degree is not None:
+            size = max(0, min(size, max_degree - offset + 1))
+        return Series(_backend.series_product(self.coeffs, other.coeffs, size), offset)
+
+    def compose(self, inner, max_degree=None):
+        """ Evaluates this series at inner, i.e. self(inner(x)), using Horner's rule. """
+        if self.offset < 0:
+            raise Exception("Can't compose a series with negative powers: " + repr(self))
+        result = Series([])
+        for c in reversed(self.coeffs):
+            result = result.multiply(inner, max_degree) + Series([c])
+        for _ in range(self.offset):
+            result = result.multiply(inner, max_degree)
+        return result
+
+    @staticmethod
+    def recurrence(base, weight, shift, terminal, depth=None, cutoff=1e-9):
+        """ Unrolls G = base + weight * x**shift * G, starting from G = terminal.
+
+            Each level is G_k = base * total(G_{k-1}) + weight * x**shift * G_{k-1},
+            which keeps integer counts exact. With depth=None the recurrence is
+            evaluated in probabilities up to its fixed point, stopping once the
+            mass that would recurse again is below cutoff. Each level costs time
+            proportional to the support, not to the number of branches.
+        """
+        total = base.total() + weight
+        if depth is None:
+            if weight == 0:
+                depth = 0
+            elif weight >= total:
+                raise Exception("Recurrence never terminates: every outcome recurses")
+            else:
+                depth = max(0, math.ceil(math.log(cutoff) / math.log(weight / total)))
+            base, weight, terminal = base * (1 / total), weight / total, terminal * (1 / terminal.total())
+        result = terminal
+        for _ in range(depth):
+            result = base * result.total() + result.shift(shift) * weight
+        return result
+
+
+def _float_series(coeffs):
+    """ Only non-negative floats go through NumPy, so integer counts stay exact. """
+    return all(type(c) == float and c >= 0 for c in coeffs)
+
+def _convolve(a, b):
+    """ The distribution of a + b, using generating functions for integer values. """
+    if all(type(v) == int for v, c in a._buckets) and all(type(v) == int for v, c in b._buckets):
+        return Series.from_dist(a).multiply(Series.from_dist(b)).to_dist()
+    return a + b
+
+def _power(d, n):
+    """ The sum of n independent rolls of d, by repeated squaring. """
+    result = None
+    while n:
+        if n & 1:
+            result = d if result is None else _convolve(result, d)
+        n >>= 1
+        if n:
+            d = _convolve(d, d)
+    return result
+
+
+class ReferenceBackend:
+    """ The pure-Python bucket operations behind Dist. Other backends are checked against these.
+
+        A backend works on lists of (value, count) buckets sorted by value and
+        returns an iterable of buckets with distinct values, in any order.
+    """
+    name = "reference"
+
+    def project(self, buckets, f, vectorized=None, monotone=False):
+        if monotone:
+            # equal projected values are adjacent, so they can be merged in one pass
+            values = []
+            counts = []
+            for v, c in buckets:
+                projected = f(v)
+                if values and values[-1] == projected:
+                    counts[-1] += c
+                else:
+                    values.append(projected)
+                    counts.append(c)
+            return zip(values, counts)
+        combined = Counter()
+        for (v, c) in buckets:
+            combined[f(v)] += c
+        return combined.items()
+
+    def combine(self, a, b, f):
+        combined = Counter()
+        for (v1, c1) in a:
+            for (v2, c2) in b:
+                new_val = f(v1, v2)
+                combined[new_val] += c1 * c2
+        return combined.items()
+
+    def mixture(self, streams):
+        """ Merges sorted bucket streams, dropping buckets whose total count isn't positive. """
+        buckets = []
+        last_v = last_c = None
+        for v, c in heapq.merge(*streams, key=operator.itemgetter(0)):
+            if v == last_v:
+                last_c += c
+                continue
+            if last_v is not None and last_c > 0:
+                buckets.append((last_v, last_c))
+            last_v, last_c = v, c
+        if last_v is not None and last_c > 0:
+            buckets.append((last_v, last_c))
+        return buckets
+
+    def series_product(self, a, b, size):
+        """ The first size coefficients of the product of two coefficient lists. """
+        # loop over the shorter series, adding a scaled copy of the longer one each time
+        short, long = sorted((a, b), key=len)
+        coeffs = [0] * size
+        for i, c in enumerate(short[:size]):
+            if not c:
+                continue
+            end = min(size, i + len(long))
+            coeffs[i:end] = [total + c * x for total, x in zip(coeffs[i:end], long)]
+        return coeffs
+
+
+class FastBackend(ReferenceBackend):
+    """ Sums dense integer dists as generating functions and projects wide dists with NumPy.
+
+        Integer counts stay exact. Float counts can differ from the reference
+        backend by rounding, but not in which of them are zero. Long float series
+        products are convolved with NumPy.
+    """
+    name = "fast"
+
+    def project(self, buckets, f, vectorized=None, monotone=False):
+        if vectorized is not None and np is not None and len(buckets) >= VECTORIZE_THRESHOLD:
+            projected = _project_vectorized(buckets, vectorized)
+            if projected is not None:
+                return projected
+        return super().project(buckets, f, vectorized, monotone)
+
+    def combine(self, a, b, f):
+        if (f is operator.add or f is operator.sub) and _dense_ints(a) and _dense_ints(b):
+            if f is operator.sub:
+                b = [(-v, c) for v, c in reversed(b)]
+            return Series.from_dist(Dist(a)).multiply(Series.from_dist(Dist(b))).to_dist()._buckets
+        return super().combine(a, b, f)
+
+    def series_product(self, a, b, size):
+        if np is not None and min(len(a), len(b)) >= CONVOLVE_THRESHOLD and _float_series(a) and _float_series(b):
+            return np.convolve(a, b)[:size].tolist()
+        return super().series_product(a, b, size)
+
+
+def _dense_ints(buckets):
+    """ Whether buckets has integer values that fill at least half of their range. """
+    return (len(buckets) > 1 and all(type(v) == int for v, c in buckets)
+            and buckets[-1][0] - buckets[0][0] < 2 * len(buckets))
+
+def _project_vectorized(buckets, vectorized):
+    """ Returns None when the values or counts don't fit in a NumPy array exactly. """
+    values = np.array([v for v, c in buckets])
+    counts = np.array([c for v, c in buckets])
+    if values.dtype == object or counts.dtype == object:
+        return None
+    if values.dtype.kind == "f" and not np.isfinite(values).all():
+        return None
+    if counts.dtype.kind == "i" and int(counts.max()) * len(counts) >= 2**62:
+        return None
+    unique, inverse = np.unique(vectorized(values), return_inverse=True)
+    if counts.dtype.kind == "i":
+        sums = np.zeros(len(unique), dtype=np.int64)
+        np.add.at(sums, inverse, counts)
+    else:
+        sums = np.bincount(inverse, weights=counts, minlength=len(unique))
+    return zip(unique.tolist(), sums.tolist())
+
+
+def bucket_difference(result, expected, tolerance=1e-9):
+    """ Describes the first difference between two bucket lists, or returns None if they match.
+
+        Values must match exactly, including their types. Integer counts must
+        match exactly and float counts within tolerance times the largest count.
+        A value missing on one side counts as zero there, but a value that is zero
+        on one side and not the other is a difference at any tolerance.
+    """
+    def totals(buckets):
+        combined = {}
+        for v, c in buckets:
+            if v in combined:
+                combined[v] = (combined[v][0], combined[v][1] + c)
+            else:
+                combined[v] = (v, c)
+        return combined
+    got = totals(result)
+    want = totals(expected)
+    scale = max([abs(c) for v, c in itertools.chain(got.values(), want.values())], default=0)
+    for key in list(want) + [key for key in got if key not in want]:
+        got_v, got_c = got.get(key, (key, 0))
+        want_v, want_c = want.get(key, (key, 0))
+        if type(got_v) != type(want_v):
+            return "value {!r} is {} but should be {}".format(key, type(got_v).__name__, type(want_v).__name__)
+        if type(got_c) == int and type(want_c) == int:
+            matches = got_c == want_c
+        elif not got_c or not want_c:
+            matches = not got_c and not want_c
+        else:
+            matches = abs(got_c - want_c) <= tolerance * scale
+        if not matches:
+            return "value {!r} has count {!r} but should have {!r}".format(key, got_c, want_c)
+    return None
+
+
+class CheckedBackend:
+    """ Runs every operation on backend and, for a sampled fraction of them, on oracle as well.
+
+        Raises as soon as the two disagree by more than bucket_difference allows.
+    """
+
+    def __init__(self, backend, oracle, sample=1.0, tolerance=1e-9, seed=None):
+        self.backend = backend
+        self.oracle = oracle
+        self.sample = sample
+        self.tolerance = tolerance
+        self.random = random.Random(seed)
+        self.name = backend.name + "+" + oracle.name
+        self.operations = 0
+        self.checked = 0
+
+    def _run(self, op, *args, as_buckets=list):
+        self.operations += 1
+        result = list(getattr(self.backend, op)(*args))
+        if self.sample >= 1 or self.random.random() < self.sample:
+            self.checked += 1
+            expected = list(getattr(self.oracle, op)(*args))
+            difference = bucket_difference(as_buckets(result), as_buckets(expected), self.tolerance)
+            if difference is not None:
+                raise Exception("Backend {} disagrees with {} in {}: {}".format(
+                    self.backend.name, self.oracle.name, op, difference))
+        return result
+
+    def project(self, buckets, f, vectorized=None, monotone=False):
+        return self._run("project", buckets, f, vectorized, monotone)
+
+    def combine(self, a, b, f):
+        return self._run("combine", a, b, f)
+
+    def mixture(self, streams):
+        return self._run("mixture", streams)
+
+    def series_product(self, a, b, size):
+        # coefficients are compared as buckets keyed by their power
+        return self._run("series_product", a, b, size, as_buckets=lambda coeffs: list(enumerate(coeffs)))
+
+
+BACKENDS = {"reference": ReferenceBackend, "fast": FastBackend}
+_backend = ReferenceBackend()
+
+def _make_backend(backend):
+    if isinstance(backend, str):
+        if backend not in BACKENDS:
+            raise Exception("Unknown backend: " + repr(backend))
+        return BACKENDS[backend]()
+    return backend
+
+def set_backend(backend="reference", check=None, sample=1.0, tolerance=1e-9, seed=None):
+    """ Chooses the backend (a name in BACKENDS, or an instance) behind Dist's bucket operations.
+
+        With check, usually "reference", each operation or a random sample
+        fraction of them is also run on the check backend, and any difference
+        beyond tolerance raises. Returns the backend in use.
+    """
+    global _backend
+    _backend = _make_backend(backend)
+    if check is not None:
+        _backend = CheckedBackend(_backend, _make_backend(check), sample, tolerance, seed)
+    return _backend
+
+def get_backend():
+    return _backend
 
-    def details(self, columns=None):
-        return self.graph(columns) + "\n" + self.summary() + "\n"
 
 def details(d):
     print(d.details())
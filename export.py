@@ -0,0 +1,117 @@
+""" Streaming writers for tables of results.
+
+    A table is any iterable of rows whose first row is the header, like the rows
+    given to awars.print_table. The writers consume rows one at a time, so a
+    generator such as awars.damage_rows or SweepResult.table can be written out
+    in constant memory.
+"""
+import csv
+import json
+import struct
+from array import array
+
+COLUMNAR_MAGIC = b"DCOL2\n"
+COLUMNAR_CHUNK_ROWS = 4096
+
+
+def write_csv(rows, f):
+    writer = csv.writer(f)
+    for row in rows:
+        writer.writerow(row)
+
+
+def write_jsonl(rows, f):
+    """ Writes one JSON object per row, keyed by the header. """
+    rows = iter(rows)
+    header = next(rows)
+    for row in rows:
+        f.write(json.dumps(dict(zip(header, row))) + "\n")
+
+
+def _encode_column(values):
+    if all(type(v) == int and -2**63 <= v < 2**63 for v in values):
+        return b"q", array("q", values).tobytes()
+    elif all(type(v) in (int, float) for v in values):
+        return b"d", array("d", values).tobytes()
+    encoded = [str(v).encode() for v in values]
+    return b"s", array("I", [len(e) for e in encoded]).tobytes() + b"".join(encoded)
+
+
+# a column's type is the widest of its row groups' types, in this order
+_COLUMN_KINDS = "qds"
+_WIDEN = {"q": int, "d": float, "s": str}
+
+
+def _decode_column(kind, payload, count):
+    if kind == b"q" or kind == b"d":
+        values = array(kind.decode())
+        values.frombytes(payload)
+        return values.tolist()
+    lengths = array("I")
+    lengths.frombytes(payload[:4 * count])
+    values = []
+    cursor = 4 * count
+    for length in lengths:
+        values.append(payload[cursor:cursor + length].decode())
+        cursor += length
+    return values
+
+
+def write_columnar(rows, f, chunk_rows=COLUMNAR_CHUNK_ROWS):
+    """ Writes rows to a binary file in column-major row groups of chunk_rows rows.
+
+        The file is the magic line, the JSON header line, then for each group a
+        row count followed by every column as (type, byte length, payload). Types
+        are int64 ("q"), float64 ("d") or length-prefixed utf-8 strings ("s").
+        A zero row count ends the groups, followed by a footer of the JSON list of
+        column types and its byte length as a uint64. A column's type is the widest
+        of its groups' types, so it reads back the same in every group.
+        f must be opened in binary mode.
+    """
+    rows = iter(rows)
+    header = next(rows)
+    f.write(COLUMNAR_MAGIC)
+    f.write(json.dumps(list(header)).encode() + b"\n")
+    kinds = ["q"] * len(header)
+
+    def flush(chunk):
+        f.write(struct.pack("<I", len(chunk)))
+        for i, column in enumerate(zip(*chunk)):
+            kind, payload = _encode_column(column)
+            kinds[i] = max(kinds[i], kind.decode(), key=_COLUMN_KINDS.index)
+            f.write(kind + struct.pack("<I", len(payload)) + payload)
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    footer = json.dumps(kinds).encode()
+    f.write(struct.pack("<I", 0) + footer + struct.pack("<Q", len(footer)))
+
+
+def read_columnar(f):
+    """ Yields the header and then each row of a file written by write_columnar.
+
+        f must be seekable, since the column types are read from the footer first.
+    """
+    if f.readline() != COLUMNAR_MAGIC:
+        raise Exception("Not a columnar results file")
+    header = json.loads(f.readline())
+    start = f.tell()
+    f.seek(-8, 2)
+    footer_length = struct.unpack("<Q", f.read(8))[0]
+    f.seek(-8 - footer_length, 2)
+    widen = [_WIDEN[kind] for kind in json.loads(f.read(footer_length))]
+    f.seek(start)
+    yield header
+    while count := struct.unpack("<I", f.read(4))[0]:
+        columns = []
+        for to_kind in widen:
+            kind = f.read(1)
+            length = struct.unpack("<I", f.read(4))[0]
+            columns.append([to_kind(v) for v in _decode_column(kind, f.read(length), count)])
+        yield from (list(row) for row in zip(*columns))
@@ -0,0 +1,122 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+# Hooks receive on_span(name, seconds) and on_count(name, value) callbacks.
+# When no hooks are installed span() hands back a shared no-op context and
+# count() returns immediately, so instrumented code pays almost nothing.
+_hooks = []
+_NULL_SPAN = nullcontext()
+
+
+def enabled():
+    return bool(_hooks)
+
+
+def add_hook(hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        for hook in _hooks:
+            hook.on_span(self.name, elapsed)
+
+
+def span(name):
+    """ Times the enclosed block and reports it to every installed hook. """
+    if not _hooks:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def count(name, value=1):
+    if not _hooks:
+        return
+    for hook in _hooks:
+        hook.on_count(name, value)
+
+
+def count_dist(name, dist):
+    """ Records the support size (number of buckets) of a distribution. """
+    if not _hooks:
+        return
+    count(name + ".support", len(dist._buckets))
+
+
+class Profile:
+    """ Collects span timings and counter statistics for a block of calls. """
+
+    def __init__(self):
+        # name -> [calls, total seconds]
+        self.spans = defaultdict(lambda: [0, 0.0])
+        # name -> [calls, total, max]
+        self.counters = defaultdict(lambda: [0, 0, 0])
+
+    def on_span(self, name, seconds):
+        entry = self.spans[name]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def on_count(self, name, value):
+        entry = self.counters[name]
+        entry[0] += 1
+        entry[1] += value
+        entry[2] = max(entry[2], value)
+
+    def report(self):
+        lines = []
+        if self.spans:
+            width = max(len(name) for name in self.spans)
+            lines.append("span".ljust(width) + "      calls   total ms    mean us")
+            for name, (calls, total) in sorted(self.spans.items(), key=lambda p: -p[1][1]):
+                lines.append("{}  {:>9} {:>10.3f} {:>10.2f}".format(
+                    name.ljust(width), calls, total * 1000, total / calls * 1e6))
+        if self.counters:
+            width = max(len(name) for name in self.counters)
+            lines.append("counter".ljust(width) + "      calls       mean        max")
+            for name, (calls, total, most) in sorted(self.counters.items()):
+                lines.append("{}  {:>9} {:>10.2f} {:>10}".format(name.ljust(width), calls, total / calls, most))
+        return "\n".join(lines)
+
+    __str__ = report
+
+
+class PrintHook:
+    """ Prints every span and counter as it happens, like the old debug flag. """
+
+    def on_span(self, name, seconds):
+        print("span {}: {:.2f}us".format(name, seconds * 1e6))
+
+    def on_count(self, name, value):
+        print("count {}: {}".format(name, value))
+
+
+@contextmanager
+def profiling():
+    """ Installs a fresh Profile for the duration of the block.
+
+        >>> with profiling() as prof:
+        ...     tank(city).attack_with(tank, tank)
+        >>> print(prof.report())
+    """
+    profile = Profile()
+    add_hook(profile)
+    try:
+        yield profile
+    finally:
+        remove_hook(profile)
@@ -0,0 +1,218 @@
+""" A local evaluation server that keeps awars loaded with warm caches.
+
+    $ python server.py serve                      # listen on 127.0.0.1:8765
+    $ python server.py serve --unix /tmp/awars.sock
+    $ python server.py load --clients 16 --requests 50
+
+    The protocol is one JSON object per line. A request is either a single query
+    or {"queries": [...]}, and the response is the matching result (or list of
+    results). Units are written the same way as in the repl, e.g. "tank(city, 5)":
+
+    {"op": "attack", "defender": "tank(city)", "attackers": ["tank", "md"], "meta": {"towers": 2}}
+    {"op": "ko_table", "defender": "neo(city)", "attackers": ["md", "md", "tank"]}
+    {"op": "compare_damage", "attackers": ["tank", "md"], "defenders": ["inf", "tank(city)"]}
+
+    CPU work runs in a process pool whose workers stay alive between requests,
+    so the damage kernels each worker has computed are reused by later queries.
+"""
+import argparse
+import ast
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import awars
+from awars import Unit, CommandingOfficer, TerrainData, PowerType
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+_SPEC_TYPES = (Unit, CommandingOfficer, TerrainData, PowerType)
+
+
+def parse_unit(spec):
+    """ Evaluates a unit expression like "tank(city, vb, 5)" without using eval. """
+    def evaluate(node):
+        if isinstance(node, ast.Name):
+            if node.id == "max":
+                return awars.co_max
+            value = getattr(awars, node.id, None)
+            if not isinstance(value, _SPEC_TYPES):
+                raise Exception("Unknown name in unit spec: " + repr(node.id))
+            return value
+        elif isinstance(node, ast.Constant) and isinstance(node.value, int):
+            return node.value
+        elif isinstance(node, ast.Call) and not node.keywords:
+            return evaluate(node.func)(*[evaluate(arg) for arg in node.args])
+        raise Exception("Unsupported unit spec: " + repr(spec))
+
+    unit = evaluate(ast.parse(spec, mode="eval").body)
+    if not isinstance(unit, Unit):
+        raise Exception("Unit spec does not describe a unit: " + repr(spec))
+    return unit
+
+
+def _dist_json(d):
+    return [[v, c] for v, c in d._buckets]
+
+
+def _unit_json(unit):
+    return {
+        "raw_hp": _dist_json(unit.raw_hp),
+        "displayed_hp": _dist_json(unit.displayed_hp),
+        "ko_chance": unit.ko_chance,
+    }
+
+
+def _query_meta(meta):
+    meta = meta or {}
+    towers = meta.get("towers", 1)
+    powers = [PowerType[meta.get("attacker_power", "no_power")], PowerType[meta.get("defender_power", "no_power")]]
+    return awars.make_meta(towers, meta.get("dtowers", towers), *powers, cities=meta.get("cities", 0))
+
+
+def run_query(query):
+    """ Runs a single query in a worker process and returns a JSON-able result. """
+    try:
+        with awars.using_meta(_query_meta(query.get("meta"))):
+            return _run_op(query)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def _run_op(query):
+    op = query["op"]
+    if op == "attack":
+        defender = parse_unit(query["defender"])
+        attackers = [parse_unit(a) for a in query["attackers"]]
+        return _unit_json(defender.attack_with(*attackers))
+    elif op == "ko_table":
+        unit = parse_unit(query["defender"])
+        table = []
+        for attacker in query["attackers"]:
+            unit = unit.attack_with(parse_unit(attacker))
+            table.append(unit.ko_chance)
+        return {"ko_chance": table}
+    elif op == "compare_damage":
+        attackers = [parse_unit(a) for a in query["attackers"]]
+        defenders = [parse_unit(d) for d in query["defenders"]] if "defenders" in query else awars.ALL_UNITS
+        return {"rows": [[d.type.name] + [a.damage_to(d)[0] for a in attackers] for d in defenders]}
+    raise Exception("Unknown op: " + repr(op))
+
+
+def warm_worker():
+    """ Fills a worker's damage cache with every full-HP matchup on neutral terrain. """
+    for attacker in awars.ALL_UNITS:
+        for defender in awars.ALL_UNITS:
+            attacker.damage_to(defender)
+
+
+class Server:
+
+    def __init__(self, workers=None):
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_worker)
+
+    async def submit(self, query):
+        if not isinstance(query, dict):
+            return {"error": "bad request: a query must be a JSON object, not " + json.dumps(query)}
+        return await asyncio.get_running_loop().run_in_executor(self.pool, run_query, query)
+
+    async def handle_request(self, request):
+        if isinstance(request, dict) and "queries" in request:
+            if not isinstance(request["queries"], list):
+                return {"error": "bad request: queries must be a list"}
+            return await asyncio.gather(*[self.submit(q) for q in request["queries"]])
+        return await self.submit(request)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    response = await self.handle_request(json.loads(line))
+                except ValueError as e:
+                    response = {"error": "bad request: " + str(e)}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix=None):
+        if unix:
+            server = await asyncio.start_unix_server(self.handle_client, unix)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+async def open_client(host=DEFAULT_HOST, port=DEFAULT_PORT, unix=None):
+    if unix:
+        return await asyncio.open_unix_connection(unix)
+    return await asyncio.open_connection(host, port)
+
+
+async def request(reader, writer, payload):
+    writer.write(json.dumps(payload).encode() + b"\n")
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+LOAD_QUERIES = [
+    {"op": "attack", "defender": "tank(city)", "attackers": ["tank", "tank"]},
+    {"op": "attack", "defender": "neo(city)", "attackers": ["md", "md", "arti"], "meta": {"towers": 2}},
+    {"op": "ko_table", "defender": "md(forest)", "attackers": ["tank", "md", "bcopter", "inf"]},
+    {"op": "compare_damage", "attackers": ["tank", "md", "neo"]},
+]
+
+
+async def load_test(clients, requests, batch, **address):
+    """ Runs concurrent clients against a server and reports latency and throughput. """
+    latencies = []
+
+    async def client(n):
+        reader, writer = await open_client(**address)
+        try:
+            for i in range(requests):
+                queries = [LOAD_QUERIES[(n + i + j) % len(LOAD_QUERIES)] for j in range(batch)]
+                start = time.perf_counter()
+                await request(reader, writer, {"queries": queries})
+                latencies.append(time.perf_counter() - start)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(n) for n in range(clients)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print("{} clients x {} requests x {} queries in {:.2f}s".format(clients, requests, batch, elapsed))
+    print("throughput: {:.1f} requests/s, {:.1f} queries/s".format(
+        len(latencies) / elapsed, len(latencies) * batch / elapsed))
+    print("latency ms: mean {:.2f}, p50 {:.2f}, p95 {:.2f}, p99 {:.2f}, max {:.2f}".format(
+        statistics.mean(latencies) * 1000, percentile(0.50), percentile(0.95), percentile(0.99),
+        latencies[-1] * 1000))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["serve", "load"])
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="use a unix socket instead of tcp")
+    parser.add_argument("--workers", type=int, help="worker processes (default: cpu count)")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--batch", type=int, default=4, help="queries per request")
+    args = parser.parse_args(argv)
+
+    address = {"host": args.host, "port": args.port, "unix": args.unix}
+    if args.command == "serve":
+        asyncio.run(Server(args.workers).serve(**address))
+    else:
+        asyncio.run(load_test(args.clients, args.requests, args.batch, **address))
+
+
+if __name__ == "__main__":
+    main()